@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""cushion_db_full.json を SQLite (cushion_db.sqlite) へ変換するワンショットスクリプト
+
+使い方:
+  python build_db.py
+
+変換後は pipeline.py が自動的に SQLite 版を優先して読む。
+JSONを更新し直した場合はこのスクリプトを再実行する。
+"""
+
+import json
+import os
+import sqlite3
+
+HERE = os.path.dirname(__file__)
+JSON_PATH = os.path.join(HERE, 'cushion_db_full.json')
+SQLITE_PATH = os.path.join(HERE, 'cushion_db.sqlite')
+
+
+def main():
+    with open(JSON_PATH, encoding='utf-8') as f:
+        db = json.load(f)
+
+    if os.path.exists(SQLITE_PATH):
+        os.remove(SQLITE_PATH)
+    conn = sqlite3.connect(SQLITE_PATH)
+    conn.execute(
+        'CREATE TABLE cushion ('
+        ' key TEXT PRIMARY KEY,'
+        ' date TEXT,'
+        ' venue TEXT,'
+        ' cushion REAL,'
+        ' turf_goal REAL,'
+        ' dirt_goal REAL'
+        ')'
+    )
+    conn.executemany(
+        'INSERT INTO cushion (key, date, venue, cushion, turf_goal, dirt_goal) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (key, e.get('date'), e.get('venue'), e.get('cushion'),
+             e.get('turf_goal'), e.get('dirt_goal'))
+            for key, e in db.items()
+        ],
+    )
+    conn.commit()
+    conn.close()
+    print(f"変換完了: {len(db)}件 → {SQLITE_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,21 +10,49 @@
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
+from lxml import html as lxml_html
+import gzip
 import re
+import threading
 import time
 import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import mmap
 import os
+import pathlib
+import sqlite3
 import sys
 import argparse
 import base64
+import hashlib
 from datetime import datetime
-from urllib.parse import quote
+
+try:
+    import orjson
+except ImportError:  # 任意依存: 無ければ標準ライブラリjsonで動く
+    orjson = None
+
+try:
+    import httpx
+except ImportError:  # 任意依存: 無ければ requests のみで動く
+    httpx = None
+
+try:
+    import pybase64
+    _b64encode = pybase64.b64encode
+except ImportError:  # 任意依存: SIMD版base64。無ければ標準ライブラリ
+    _b64encode = base64.b64encode
 
 # ===== 設定 =====
-CUSHION_DB_PATH = os.path.join(os.path.dirname(__file__), 'cushion_db_full.json')
-OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
-CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+_HERE = pathlib.Path(__file__).resolve().parent
+CUSHION_DB_PATH = _HERE / 'cushion_db_full.json'
+CUSHION_DB_SQLITE_PATH = _HERE / 'cushion_db.sqlite'
+OUTPUT_DIR = _HERE / 'output'
+CACHE_DIR = _HERE / 'cache'
 
 VENUE_CODES = {
     '01': '札幌', '02': '函館', '03': '福島', '04': '新潟',
@@ -32,45 +60,289 @@ VENUE_CODES = {
     '09': '阪神', '10': '小倉'
 }
 
+# インデックスページでの会場の表示順
+VENUE_ORDER = ('東京', '京都', '小倉', '中山', '阪神', '中京', '新潟', '福島', '函館', '札幌')
+
+# 戦績テーブルの会場略称 → 正式名
+VENUE_SHORT_MAP = {
+    '東': '東京', '京': '京都', '中': '中山', '阪': '阪神',
+    '小': '小倉', '新': '新潟', '福': '福島', '函': '函館',
+    '札': '札幌', '中京': '中京',
+}
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# 全HTTPリクエスト共通セッション（keep-alive + コネクションプールで毎回のTCP/TLSハンドシェイクを省く）
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': USER_AGENT})
+# ステータス起因の再試行はアダプタに持たせない（RetryErrorで送出されてしまい、
+# _polite_get の429/5xxバックオフに届かなくなる）。ここは接続エラーの再試行のみ
+_adapter = HTTPAdapter(
+    pool_connections=8, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# httpx[http2] が入っていれば、スクレイピングのGETを1本のTLS接続にHTTP/2多重化する
+_HTTP2_CLIENT = None
+if httpx is not None:
+    try:
+        _HTTP2_CLIENT = httpx.Client(
+            http2=True,
+            headers={'User-Agent': USER_AGENT},
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+            timeout=30.0,
+        )
+    except ImportError:  # http2 エクストラ (h2) 未インストール
+        _HTTP2_CLIENT = None
+
+
+def _http_get(url):
+    """GET 1回。httpx(HTTP/2)が使えれば多重化、なければ共有requestsセッション"""
+    if _HTTP2_CLIENT is not None:
+        return _HTTP2_CLIENT.get(url)
+    return SESSION.get(url)
+
+
+def _polite_get(url, max_attempts=5):
+    """429/5xx のときだけ指数バックオフで再試行するGET（平常時は待たない）
+
+    Retry-After ヘッダがあればそれを優先する。
+    """
+    r = None
+    for attempt in range(max_attempts):
+        r = _http_get(url)
+        if r.status_code != 429 and r.status_code < 500:
+            return r
+        retry_after = r.headers.get('Retry-After')
+        wait = float(retry_after) if retry_after and retry_after.isdigit() else float(2 ** attempt)
+        print(f"    HTTP {r.status_code}: {wait:.0f}秒待って再試行 ({url})")
+        time.sleep(wait)
+    return r
+
+# 馬詳細ページの並列取得数（db.netkeiba.com への同時接続上限）
+HORSE_WORKERS = 8
+
+# レース単位の並列スクレイピング数
+RACE_WORKERS = 4
+
+
+class _RateLimiter:
+    """ホスト単位の簡易レートリミッタ（最小リクエスト間隔を保証）"""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# db.netkeiba.com 向け: 並列化しても秒間リクエスト数は従来水準に抑える
+_NETKEIBA_LIMITER = _RateLimiter(min_interval=0.1)
+
+# 取得済みHTMLのディスクキャッシュ有効期間（秒）
+HTTP_CACHE_TTL = 3600
+
+# JRA馬場ページのキャッシュ有効期間（秒）。値の更新は1日数回なので短めのTTLで十分
+JRA_CACHE_TTL = 300
+
+# ホットループで使う正規表現はモジュールロード時に一度だけコンパイルする
+_RC_ID_RE = re.compile(r'^rc[A-Z]')
+_RID_RE = re.compile(r'race_id=(\d+)')
+_SD_RE = re.compile(r'(芝|ダ|障)(\d+)m')
+_SD_SHORT_RE = re.compile(r'(芝|ダ|障)(\d+)')
+_HORSE_ID_RE = re.compile(r'/horse/(\d+)')
+_NAME_RE = re.compile(r'\d+R(.+?)[\d:]+')
+_DIGITS_RE = re.compile(r'\d+')
+
+def _class_xpath(tag, cls):
+    """class属性に cls を含む要素を拾うXPathをコンパイルして返す"""
+    return etree.XPath(
+        f'.//{tag}[contains(concat(" ", normalize-space(@class), " "), " {cls} ")]'
+    )
+
+
+# JRA 馬場情報ページ用のコンパイル済みXPath（BS4のPython側ツリー走査を避ける）
+_JRA_RC_XPATH = etree.XPath('//div[starts-with(@id, "rc")]')
+_UNIT_XPATH = _class_xpath('div', 'unit')
+_CUSHION_XPATH = _class_xpath('div', 'cushion')
+_TIME_XPATH = _class_xpath('div', 'time')
+_TURF_XPATH = _class_xpath('div', 'turf')
+_DIRT_XPATH = _class_xpath('div', 'dirt')
+_MG_XPATH = _class_xpath('span', 'mg')
+
+# netkeiba レース一覧・出馬表用のコンパイル済みXPath
+_RACE_LINK_XPATH = etree.XPath('//a[contains(@href, "race_id=")]')
+_RACE_NAME_XPATH = _class_xpath('div', 'RaceName')
+_RACE_DATA01_XPATH = _class_xpath('div', 'RaceData01')
+_SHUTUBA_TABLE_XPATH = etree.XPath(
+    '//table[contains(@class, "Shutuba_Table")] | //table[@id="shutuba_table"]'
+)
+_HORSELIST_ROW_XPATH = _class_xpath('tr', 'HorseList')
+_HORSE_LINK_XPATH = etree.XPath('.//a[contains(@href, "/horse/")]')
+
+
+def _parse_tree(content, encoding):
+    """バイト列を既知のエンコーディングで一度だけデコードしてlxmlツリーに変換
+
+    requests の .text プロパティ経由の再デコードやパーサ側の
+    エンコーディング推測（UnicodeDammit相当）を完全に回避する。
+    """
+    return lxml_html.fromstring(content.decode(encoding, 'replace'))
+
+
+def _text_compact(el):
+    """BS4 の get_text(strip=True) 相当（テキスト断片を個別にstripして連結）"""
+    return ''.join(t.strip() for t in el.itertext())
+
+
+# 戦績テーブル用のコンパイル済みXPath。必要5列は normalize-space() で文字列まで
+# C側で取り出す（要素プロキシの生成とPython側の text_content/strip を省く）
+_RESULT_ROW_XPATH = etree.XPath('//table[contains(@class, "db_h_race_results")]//tr')
+_RESULT_TD_COUNT_XPATH = etree.XPath('count(td)')
+_RESULT_DATE_XPATH = etree.XPath('normalize-space(td[1])')
+_RESULT_VENUE_XPATH = etree.XPath('normalize-space(td[2])')
+_RESULT_RNAME_XPATH = etree.XPath('normalize-space(td[5])')
+_RESULT_ORDER_XPATH = etree.XPath('normalize-space(td[12])')
+_RESULT_DIST_XPATH = etree.XPath('normalize-space(td[15])')
+
+
+class SqliteCushionDB:
+    """SQLite版クッション値DB（build_db.py で作成）
+
+    dict と同じ in / [] / get / len を提供しつつ、全件をメモリに
+    ロードせずキー単位で引く。JSON版が巨大化しても起動コストが一定になる。
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # 同じ (日付_会場) キーはレースを跨いで何度も引かれるので、
+        # 一度引いた結果（ミスも含め）をプロセス内に持つ
+        self._memo = {}
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM cushion').fetchone()[0]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def get(self, key, default=None):
+        if key in self._memo:
+            entry = self._memo[key]
+            return entry if entry is not None else default
+        row = self._conn.execute(
+            'SELECT date, venue, cushion, turf_goal, dirt_goal FROM cushion WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            self._memo[key] = None
+            return default
+        entry = {'date': row[0], 'venue': row[1], 'cushion': row[2],
+                 'turf_goal': row[3], 'dirt_goal': row[4]}
+        self._memo[key] = entry
+        return entry
+
+    def add(self, key, entry):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO cushion (key, date, venue, cushion, turf_goal, dirt_goal) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (key, entry.get('date'), entry.get('venue'), entry.get('cushion'),
+             entry.get('turf_goal'), entry.get('dirt_goal')))
+        self._conn.commit()
+        self._memo[key] = entry
+
+
+def load_cushion_db():
+    """クッション値DBをロード（SQLite版があれば優先、なければ従来のJSON）"""
+    if CUSHION_DB_SQLITE_PATH.exists():
+        return SqliteCushionDB(CUSHION_DB_SQLITE_PATH)
+    if orjson is not None:
+        with open(CUSHION_DB_PATH, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(CUSHION_DB_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _cached_page(name, url, ttl=HTTP_CACHE_TTL, limiter=None):
+    """URLの生HTMLを CACHE_DIR に gzip 保存し、TTL内はネットワークを介さず返す
+
+    再試行しても200にならなかった場合は None（呼び出し側でエラーページを
+    パースして空の結果を作ってしまわないため）。
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = CACHE_DIR / f'{name}.html.gz'
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            with gzip.open(path, 'rb') as f:
+                return f.read()
+    except OSError:
+        pass
+    if limiter is not None:
+        limiter.wait()
+    r = _polite_get(url)
+    if r.status_code != 200:
+        print(f"    WARNING: HTTP {r.status_code} ({url})")
+        return None
+    with gzip.open(path, 'wb') as f:
+        f.write(r.content)
+    return r.content
+
 
 # ===== Step 1: JRA ライブデータ取得 =====
 def fetch_jra_live():
     """JRA公式からクッション値・含水率をリアルタイム取得"""
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
     result = {}
 
     # クッション値
-    r = requests.get('https://www.jra.go.jp/keiba/baba/_data_cushion.html', headers=headers)
-    r.encoding = 'shift_jis'
-    soup = BeautifulSoup(r.text, 'html.parser')
-    for div in soup.find_all('div', id=re.compile(r'^rc[A-Z]')):
-        venue = div.get('title', '')
-        units = div.find_all('div', class_='unit')
-        if units:
-            cushion_text = units[0].find('div', class_='cushion').get_text(strip=True)
-            time_text = units[0].find('div', class_='time').get_text(strip=True)
-            result[venue] = {'cushion': float(cushion_text), 'time_cushion': time_text}
+    content = _cached_page('jra_cushion', 'https://www.jra.go.jp/keiba/baba/_data_cushion.html',
+                           ttl=JRA_CACHE_TTL)
+    if content is not None:
+        tree = _parse_tree(content, 'shift_jis')
+        for div in _JRA_RC_XPATH(tree):
+            if not _RC_ID_RE.match(div.get('id', '')):
+                continue
+            venue = div.get('title', '')
+            units = _UNIT_XPATH(div)
+            if units:
+                cushion_text = _CUSHION_XPATH(units[0])[0].text_content().strip()
+                time_text = _TIME_XPATH(units[0])[0].text_content().strip()
+                result[venue] = {'cushion': float(cushion_text), 'time_cushion': time_text}
 
     # 含水率
-    r = requests.get('https://www.jra.go.jp/keiba/baba/_data_moist.html', headers=headers)
-    r.encoding = 'shift_jis'
-    soup = BeautifulSoup(r.text, 'html.parser')
-    for div in soup.find_all('div', id=re.compile(r'^rc[A-Z]')):
-        venue = div.get('title', '')
-        units = div.find_all('div', class_='unit')
-        if units:
-            u = units[0]
-            turf_div = u.find('div', class_='turf')
-            dirt_div = u.find('div', class_='dirt')
-            turf_mg = float(turf_div.find('span', class_='mg').get_text(strip=True)) if turf_div else None
-            dirt_mg = float(dirt_div.find('span', class_='mg').get_text(strip=True)) if dirt_div else None
-            time_text = u.find('div', class_='time').get_text(strip=True)
-            if venue in result:
-                result[venue]['turf_moisture'] = turf_mg
-                result[venue]['dirt_moisture'] = dirt_mg
-                result[venue]['time_moisture'] = time_text
-            else:
-                result[venue] = {'turf_moisture': turf_mg, 'dirt_moisture': dirt_mg, 'time_moisture': time_text}
+    content = _cached_page('jra_moist', 'https://www.jra.go.jp/keiba/baba/_data_moist.html',
+                           ttl=JRA_CACHE_TTL)
+    if content is not None:
+        tree = _parse_tree(content, 'shift_jis')
+        for div in _JRA_RC_XPATH(tree):
+            if not _RC_ID_RE.match(div.get('id', '')):
+                continue
+            venue = div.get('title', '')
+            units = _UNIT_XPATH(div)
+            if units:
+                u = units[0]
+                turf_divs = _TURF_XPATH(u)
+                dirt_divs = _DIRT_XPATH(u)
+                turf_mg = float(_MG_XPATH(turf_divs[0])[0].text_content().strip()) if turf_divs else None
+                dirt_mg = float(_MG_XPATH(dirt_divs[0])[0].text_content().strip()) if dirt_divs else None
+                time_text = _TIME_XPATH(u)[0].text_content().strip()
+                if venue in result:
+                    result[venue]['turf_moisture'] = turf_mg
+                    result[venue]['dirt_moisture'] = dirt_mg
+                    result[venue]['time_moisture'] = time_text
+                else:
+                    result[venue] = {'turf_moisture': turf_mg, 'dirt_moisture': dirt_mg, 'time_moisture': time_text}
 
     return result
 
@@ -79,31 +351,29 @@ def fetch_jra_live():
 def get_race_list(date_str):
     """netkeiba からレース一覧取得 (date_str: YYYYMMDD)"""
     url = f'https://race.netkeiba.com/top/race_list_sub.html?kaisai_date={date_str}'
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-    r = requests.get(url, headers=headers)
-    r.encoding = 'utf-8'
-    soup = BeautifulSoup(r.text, 'html.parser')
+    r = _http_get(url)
+    tree = _parse_tree(r.content, 'utf-8')
 
-    links = soup.find_all('a', href=re.compile(r'race_id=\d+'))
+    links = _RACE_LINK_XPATH(tree)
     seen = set()
     races = []
     for link in links:
-        m = re.search(r'race_id=(\d+)', link.get('href', ''))
+        m = _RID_RE.search(link.get('href') or '')
         if m and m.group(1) not in seen:
             rid = m.group(1)
             seen.add(rid)
-            text = link.get_text(strip=True)
+            text = _text_compact(link)
             venue_code = rid[4:6]
             venue = VENUE_CODES.get(venue_code, '?')
             race_num = int(rid[10:12])
 
             # Parse surface and distance from text
-            sd_match = re.search(r'(芝|ダ|障)(\d+)m', text)
+            sd_match = _SD_RE.search(text)
             surface = sd_match.group(1) if sd_match else '?'
             distance = int(sd_match.group(2)) if sd_match else 0
 
             # Parse race name
-            name_match = re.match(r'\d+R(.+?)[\d:]+', text)
+            name_match = _NAME_RE.match(text)
             race_name = name_match.group(1) if name_match else text
 
             races.append({
@@ -119,25 +389,87 @@ def get_race_list(date_str):
     return races
 
 
+# レースデータキャッシュ（レースごとの個別JSONをやめ、WALの単一SQLiteに集約）
+_RACE_CACHE = None
+_RACE_CACHE_LOCK = threading.Lock()
+
+
+def _race_cache():
+    global _RACE_CACHE
+    with _RACE_CACHE_LOCK:
+        if _RACE_CACHE is None:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(CACHE_DIR / 'cache.sqlite', check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (rid TEXT PRIMARY KEY, data BLOB)')
+            _RACE_CACHE = conn
+    return _RACE_CACHE
+
+
+@functools.lru_cache(maxsize=256)
+def _race_cache_get(race_id):
+    """SQLiteからレースデータをロード。同一プロセス内の再ロードはLRUで即返す"""
+    conn = _race_cache()
+    with _RACE_CACHE_LOCK:
+        row = conn.execute('SELECT data FROM cache WHERE rid = ?', (race_id,)).fetchone()
+    if row is None:
+        return None
+    if orjson is not None:
+        return orjson.loads(row[0])
+    return json.loads(row[0])
+
+
+def _race_cache_put(race_id, race_data):
+    if orjson is not None:
+        data = orjson.dumps(race_data)
+    else:
+        data = json.dumps(race_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    conn = _race_cache()
+    with _RACE_CACHE_LOCK:
+        conn.execute('INSERT OR REPLACE INTO cache (rid, data) VALUES (?, ?)', (race_id, data))
+        conn.commit()
+    # 保存前のミスがLRUに残っているかもしれないので破棄する
+    _race_cache_get.cache_clear()
+
+
 # ===== Step 3: 出走馬+過去戦績取得 =====
-def scrape_race_data(race_id):
-    """netkeiba から出走馬と各馬の過去戦績を取得"""
-    session = requests.Session()
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    })
+def scrape_race_data(race_id, no_scrape=False):
+    """netkeiba から出走馬と各馬の過去戦績を取得（キャッシュ済みならネットワークを介さず返す）"""
+    race_data = _race_cache_get(race_id)
+    if race_data is not None:
+        print(f"  キャッシュ使用: race_{race_id}")
+        return race_data
+
+    # 旧形式の個別JSONキャッシュがあればSQLiteへ取り込んで使う
+    cache_file = CACHE_DIR / f'race_{race_id}.json'
+    if cache_file.exists():
+        print(f"  キャッシュ使用: {cache_file} (SQLiteへ移行)")
+        if orjson is not None:
+            with open(cache_file, 'rb') as f:
+                race_data = orjson.loads(f.read())
+        else:
+            with open(cache_file, encoding='utf-8') as f:
+                race_data = json.load(f)
+        _race_cache_put(race_id, race_data)
+        return race_data
+    if no_scrape:
+        return None
 
     # 出馬表取得
+    print(f"  netkeiba スクレイピング中...")
     url = f'https://race.netkeiba.com/race/shutuba.html?race_id={race_id}'
-    r = session.get(url)
-    r.encoding = 'euc-jp'
-    soup = BeautifulSoup(r.text, 'html.parser')
-
-    race_name_tag = soup.find('div', class_='RaceName')
-    race_name = race_name_tag.get_text(strip=True) if race_name_tag else ''
-    race_data_tag = soup.find('div', class_='RaceData01')
-    race_data_text = race_data_tag.get_text(strip=True) if race_data_tag else ''
-    sd_match = re.search(r'(芝|ダ|障)(\d+)m', race_data_text)
+    content = _cached_page(f'shutuba_{race_id}', url)
+    if content is None:
+        print(f"    WARNING: 出馬表の取得失敗")
+        return None
+    tree = _parse_tree(content, 'euc-jp')
+
+    race_name_tags = _RACE_NAME_XPATH(tree)
+    race_name = _text_compact(race_name_tags[0]) if race_name_tags else ''
+    race_data_tags = _RACE_DATA01_XPATH(tree)
+    race_data_text = _text_compact(race_data_tags[0]) if race_data_tags else ''
+    sd_match = _SD_RE.search(race_data_text)
     surface = sd_match.group(1) if sd_match else '?'
     distance = int(sd_match.group(2)) if sd_match else 0
     venue_code = race_id[4:6]
@@ -145,30 +477,43 @@ def scrape_race_data(race_id):
 
     # 馬一覧
     horses = []
-    table = soup.find('table', class_='Shutuba_Table') or soup.find('table', id='shutuba_table')
-    if not table:
+    tables = _SHUTUBA_TABLE_XPATH(tree)
+    if not tables:
         print(f"    WARNING: Shutuba table not found")
         return None
 
-    rows = table.find_all('tr', class_='HorseList')
-    for row in rows:
-        horse_link = row.find('a', href=re.compile(r'/horse/\d+'))
-        if not horse_link:
+    for row in _HORSELIST_ROW_XPATH(tables[0]):
+        horse_link = None
+        horse_id_match = None
+        for a in _HORSE_LINK_XPATH(row):
+            horse_id_match = _HORSE_ID_RE.search(a.get('href') or '')
+            if horse_id_match:
+                horse_link = a
+                break
+        if horse_link is None:
             continue
-        horse_name = horse_link.get_text(strip=True)
-        horse_id_match = re.search(r'/horse/(\d+)', horse_link.get('href', ''))
-        horse_id = horse_id_match.group(1) if horse_id_match else None
-        horses.append({'name': horse_name, 'horse_id': horse_id})
+        horse_name = _text_compact(horse_link)
+        horses.append({'name': horse_name, 'horse_id': horse_id_match.group(1)})
 
-    # 各馬の過去戦績
+    # 各馬の過去戦績（I/Oバウンドなのでスレッドで並列取得、レート制限は _NETKEIBA_LIMITER が担保）
     all_horses = {}
-    for h in horses:
-        results = get_horse_results(session, h['horse_id'])
-        all_horses[h['name']] = results
-        print(f"    {h['name']}: {len(results)}走")
-        time.sleep(0.5)
+    lines = []
+    fetch_failed = False
+    with ThreadPoolExecutor(max_workers=HORSE_WORKERS) as executor:
+        for h, results in zip(horses, executor.map(lambda h: get_horse_results(h['horse_id']), horses)):
+            if results is None:
+                # 取得失敗はデータなしと区別し、このレースはキャッシュしない
+                fetch_failed = True
+                all_horses[h['name']] = []
+                lines.append(f"    {h['name']}: 取得失敗")
+            else:
+                all_horses[h['name']] = results
+                lines.append(f"    {h['name']}: {len(results)}走")
+    if lines:
+        # 1馬ごとにstdoutをフラッシュせず、レース単位でまとめて出す
+        print('\n'.join(lines))
 
-    return {
+    race_data = {
         'race_info': {
             'race_id': race_id,
             'race_name': race_name,
@@ -178,46 +523,42 @@ def scrape_race_data(race_id):
         },
         'horses': all_horses,
     }
+    if fetch_failed:
+        # 失敗込みの結果を恒久キャッシュに焼き込まない（次回の実行で再取得させる）
+        print(f"  取得失敗あり: race_{race_id} はキャッシュしない")
+    else:
+        _race_cache_put(race_id, race_data)
+        print(f"  キャッシュ保存: race_{race_id}")
+    return race_data
 
 
-def get_horse_results(session, horse_id, max_races=10):
-    """馬の過去戦績を取得"""
+def get_horse_results(horse_id, max_races=10):
+    """馬の過去戦績を取得（取得失敗時は None。0走の [] とは区別する）"""
     url = f'https://db.netkeiba.com/horse/result/{horse_id}/'
-    r = session.get(url)
-    r.encoding = 'euc-jp'
-    soup = BeautifulSoup(r.text, 'html.parser')
+    content = _cached_page(f'horse_{horse_id}', url, limiter=_NETKEIBA_LIMITER)
+    if content is None:
+        return None
+    tree = _parse_tree(content, 'euc-jp')
 
     results = []
-    table = soup.find('table', class_='db_h_race_results')
-    if not table:
-        return results
-
-    venue_short_map = {
-        '東': '東京', '京': '京都', '中': '中山', '阪': '阪神',
-        '小': '小倉', '新': '新潟', '福': '福島', '函': '函館',
-        '札': '札幌', '中京': '中京',
-    }
 
-    rows = table.find_all('tr')
+    rows = _RESULT_ROW_XPATH(tree)
     for tr in rows[1:max_races + 1]:
-        cells = tr.find_all('td')
-        if len(cells) < 15:
+        # 15列未満の行（ヘッダ・注記）はここで弾く
+        if _RESULT_TD_COUNT_XPATH(tr) < 15:
             continue
         try:
-            date = cells[0].get_text(strip=True)
-            venue_raw = cells[1].get_text(strip=True)
-            race_name = cells[4].get_text(strip=True)
-            result_text = cells[11].get_text(strip=True)
+            date = _RESULT_DATE_XPATH(tr)
+            venue_raw = _RESULT_VENUE_XPATH(tr)
+            race_name = _RESULT_RNAME_XPATH(tr)
+            result_text = _RESULT_ORDER_XPATH(tr)
             result = int(result_text) if result_text.isdigit() else None
-            dist_text = cells[14].get_text(strip=True)
-            sd_match = re.search(r'(芝|ダ|障)(\d+)', dist_text)
+            dist_text = _RESULT_DIST_XPATH(tr)
+            sd_match = _SD_SHORT_RE.search(dist_text)
             surface = sd_match.group(1) if sd_match else '?'
             distance = int(sd_match.group(2)) if sd_match else 0
-            venue = re.sub(r'\d+', '', venue_raw).strip()
-            for short, full in venue_short_map.items():
-                if venue == short:
-                    venue = full
-                    break
+            venue = _DIGITS_RE.sub('', venue_raw).strip()
+            venue = VENUE_SHORT_MAP.get(venue, venue)
 
             results.append({
                 'date': date,
@@ -236,15 +577,20 @@ def get_horse_results(session, horse_id, max_races=10):
 # ===== Step 4: クッション値紐付け =====
 def link_cushion_data(race_data, cushion_db):
     """各馬の過去レースにクッション値・含水率を紐付け"""
+    # 同じ (日付, 会場) は馬を跨いで何度も現れるため、ユニークキーだけ先に一括ルックアップする
+    keys = {(r['date'], r['venue'])
+            for races in race_data['horses'].values() for r in races}
+    hits = {}
+    for date, venue in keys:
+        entry = cushion_db.get(f"{date}_{venue}")
+        if entry is not None:
+            hits[(date, venue)] = entry
+
     for horse_name, races in race_data['horses'].items():
         for r in races:
-            date = r['date']
-            venue = r['venue']
             surface = r.get('surface', '芝')
-
-            key = f"{date}_{venue}"
-            if key in cushion_db:
-                entry = cushion_db[key]
+            entry = hits.get((r['date'], r['venue']))
+            if entry is not None:
                 r['cushion'] = entry['cushion']
                 if surface == 'ダ' or surface == 'ダート':
                     r['moisture'] = entry.get('dirt_goal')
@@ -257,169 +603,97 @@ def link_cushion_data(race_data, cushion_db):
     return race_data
 
 
-# ===== Step 5: 散布図HTML生成 =====
-def generate_scatter_html(race_data, target_cushion, target_moisture, output_path, date_label='', race_num=0):
-    """散布図HTMLを生成"""
-    race_info = race_data['race_info']
-    venue = race_info['venue']
-    race_name = race_info['race_name']
-    surface = race_info['surface']
-    distance = race_info['distance']
-
-    js_horses = []
-    for horse_name, races in race_data['horses'].items():
-        js_races = []
-        for r in races:
-            if r.get('cushion') is None or r.get('moisture') is None:
-                continue
-            if r['surface'] != surface:
-                cat = 'diff_surface'
-            elif r['distance'] == distance:
-                cat = 'same_dist'
-            else:
-                cat = 'diff_dist'
-
-            js_races.append({
-                'date': r['date'],
-                'venue': r['venue'],
-                'surface': r['surface'],
-                'distance': r['distance'],
-                'race_name': r['race_name'],
-                'result': r['result'],
-                'cushion': r['cushion'],
-                'moisture': r['moisture'],
-                'cat': cat,
-                'good': r['result'] is not None and r['result'] <= 3,
-            })
-        js_horses.append({'name': horse_name, 'races': js_races})
-
-    horses_json = json.dumps(js_horses, ensure_ascii=False)
-    surface_label = '芝' if surface == '芝' else 'ダート'
-    color_same = f'同距離{surface_label}'
-    color_diff = f'他距離{surface_label}'
-    color_other = 'ダート' if surface == '芝' else '芝レース'
-
-    html = f"""<!DOCTYPE html>
-<html lang="ja">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
-<title>クッション値×含水率 - {venue}{race_name}</title>
-<style>
-* {{ margin: 0; padding: 0; box-sizing: border-box; }}
-body {{
+# 散布図HTMLの静的部分（CSS/JS）。レースごとに変わらないのでモジュール定数として一度だけ持ち、
+# f-string の波括弧エスケープと巨大文字列の再構築を避ける
+_SCATTER_CSS = """* { margin: 0; padding: 0; box-sizing: border-box; }
+body {
   font-family: -apple-system, BlinkMacSystemFont, 'Noto Sans JP', sans-serif;
   background: #fff; color: #1e293b; overflow: hidden; height: 100vh;
-}}
-.header {{
+}
+.header {
   background: #fff; border-bottom: 1px solid #e2e8f0;
   padding: 12px 16px; z-index: 100;
   box-shadow: 0 1px 3px rgba(0,0,0,0.05); flex-shrink: 0;
-}}
-.header h1 {{ font-size: 16px; font-weight: 900; letter-spacing: -0.5px; }}
-.header .sub {{ font-size: 11px; color: #64748b; margin-top: 2px; }}
-.header .target {{
+}
+.header h1 { font-size: 16px; font-weight: 900; letter-spacing: -0.5px; }
+.header .sub { font-size: 11px; color: #64748b; margin-top: 2px; }
+.header .target {
   display: inline-flex; gap: 12px; margin-top: 4px;
   font-size: 11px; font-weight: 700; font-family: monospace;
-}}
-.header .target span {{
+}
+.header .target span {
   background: #f8fafc; border: 1px solid #e2e8f0;
   padding: 2px 8px; border-radius: 4px;
-}}
-.main {{ display: flex; flex-direction: column; flex: 1; overflow: hidden; }}
-@media (min-width: 768px) {{ .main {{ flex-direction: row; }} }}
-.chart-area {{ position: relative; width: 100%; height: 40vh; min-height: 250px; flex-shrink: 0; }}
-@media (min-width: 768px) {{ .chart-area {{ flex: 1; height: 100%; }} }}
-canvas {{ display: block; width: 100% !important; height: 100% !important; touch-action: pan-y; }}
-.panel {{
+}
+.main { display: flex; flex-direction: column; flex: 1; overflow: hidden; }
+@media (min-width: 768px) { .main { flex-direction: row; } }
+.chart-area { position: relative; width: 100%; height: 40vh; min-height: 250px; flex-shrink: 0; }
+@media (min-width: 768px) { .chart-area { flex: 1; height: 100%; } }
+canvas { display: block; width: 100% !important; height: 100% !important; touch-action: pan-y; }
+.panel {
   border-top: 1px solid #e2e8f0; overflow-y: auto; padding: 8px 8px 80px 8px; background: #f8fafc;
   flex: 1;
-}}
-@media (min-width: 768px) {{
-  .panel {{ width: 320px; border-top: none; border-left: 1px solid #e2e8f0; }}
-}}
-.horse-btn {{
+}
+@media (min-width: 768px) {
+  .panel { width: 320px; border-top: none; border-left: 1px solid #e2e8f0; }
+}
+.horse-btn {
   display: flex; align-items: center; gap: 10px; width: 100%;
   padding: 10px 14px; margin-bottom: 4px; border: 1px solid #e2e8f0;
   border-radius: 12px; background: #fff; cursor: pointer;
   transition: all 0.2s; font-size: 14px; font-weight: 700; color: #1e293b;
   -webkit-tap-highlight-color: transparent;
-}}
-.horse-btn:active {{ transform: scale(0.98); }}
-.horse-btn.selected {{
+}
+.horse-btn:active { transform: scale(0.98); }
+.horse-btn.selected {
   border-color: #f59e0b; background: #fffbeb;
   box-shadow: 0 0 0 2px rgba(245,158,11,0.2);
-}}
-.horse-btn .count {{ font-size: 10px; color: #94a3b8; font-weight: 600; margin-left: auto; }}
-.horse-btn .dot {{ width: 8px; height: 8px; border-radius: 50%; flex-shrink: 0; }}
-.rating-row {{
+}
+.horse-btn .count { font-size: 10px; color: #94a3b8; font-weight: 600; margin-left: auto; }
+.horse-btn .dot { width: 8px; height: 8px; border-radius: 50%; flex-shrink: 0; }
+.rating-row {
   display: flex; gap: 4px; padding: 4px 14px 8px 22px;
-}}
-.rating-btn {{
+}
+.rating-btn {
   width: 32px; height: 28px; border: 1.5px solid #cbd5e1; border-radius: 6px;
   background: #fff; cursor: pointer; font-size: 12px; font-weight: 800;
   color: #94a3b8; transition: all 0.15s; -webkit-tap-highlight-color: transparent;
-}}
-.rating-btn:active {{ transform: scale(0.92); }}
-.rating-btn.rated-S {{ background: #dc2626; border-color: #dc2626; color: #fff; }}
-.rating-btn.rated-A {{ background: #f59e0b; border-color: #f59e0b; color: #fff; }}
-.rating-btn.rated-B {{ background: #3b82f6; border-color: #3b82f6; color: #fff; }}
-.rating-btn.rated-C {{ background: #22c55e; border-color: #22c55e; color: #fff; }}
-.rating-btn.rated-D {{ background: #94a3b8; border-color: #94a3b8; color: #fff; }}
-.horse-detail {{ display: none; padding: 8px 4px; }}
-.horse-detail.show {{ display: block; }}
-.race-card {{ display: grid; grid-template-columns: 1fr 1fr; gap: 6px; margin-top: 6px; }}
-.race-item {{
+}
+.rating-btn:active { transform: scale(0.92); }
+.rating-btn.rated-S { background: #dc2626; border-color: #dc2626; color: #fff; }
+.rating-btn.rated-A { background: #f59e0b; border-color: #f59e0b; color: #fff; }
+.rating-btn.rated-B { background: #3b82f6; border-color: #3b82f6; color: #fff; }
+.rating-btn.rated-C { background: #22c55e; border-color: #22c55e; color: #fff; }
+.rating-btn.rated-D { background: #94a3b8; border-color: #94a3b8; color: #fff; }
+.horse-detail { display: none; padding: 8px 4px; }
+.horse-detail.show { display: block; }
+.race-card { display: grid; grid-template-columns: 1fr 1fr; gap: 6px; margin-top: 6px; }
+.race-item {
   padding: 8px 10px; border-radius: 10px; border: 1px solid #e2e8f0;
   background: #fff; font-size: 10px; cursor: pointer;
-}}
-.race-item.ideal {{ background: #ecfdf5; border-color: #a7f3d0; }}
-.race-item.highlighted {{ border-color: #f59e0b; box-shadow: 0 0 0 2px rgba(245,158,11,0.3); }}
-.race-item .date {{ color: #94a3b8; font-weight: 600; font-family: monospace; }}
-.race-item .rname {{ color: #1e293b; font-weight: 700; font-size: 10px; margin-top: 1px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
-.race-item .result {{ font-size: 13px; font-weight: 900; }}
-.race-item .cond {{ color: #64748b; font-weight: 700; }}
-.legend {{
+}
+.race-item.ideal { background: #ecfdf5; border-color: #a7f3d0; }
+.race-item.highlighted { border-color: #f59e0b; box-shadow: 0 0 0 2px rgba(245,158,11,0.3); }
+.race-item .date { color: #94a3b8; font-weight: 600; font-family: monospace; }
+.race-item .rname { color: #1e293b; font-weight: 700; font-size: 10px; margin-top: 1px; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+.race-item .result { font-size: 13px; font-weight: 900; }
+.race-item .cond { color: #64748b; font-weight: 700; }
+.legend {
   display: flex; gap: 12px; padding: 8px 16px; font-size: 10px;
   font-weight: 700; color: #94a3b8; border-top: 1px solid #e2e8f0; flex-wrap: wrap;
-}}
-.legend span {{ display: flex; align-items: center; gap: 4px; }}
-.legend .dot {{ width: 8px; height: 8px; border-radius: 50%; display: inline-block; }}
-.tooltip {{
+}
+.legend span { display: flex; align-items: center; gap: 4px; }
+.legend .dot { width: 8px; height: 8px; border-radius: 50%; display: inline-block; }
+.tooltip {
   display: none; position: fixed; background: rgba(15,23,42,0.95); color: #fff;
   padding: 10px 14px; border-radius: 10px; font-size: 12px; line-height: 1.6;
   pointer-events: none; z-index: 200; max-width: 250px;
   box-shadow: 0 4px 12px rgba(0,0,0,0.3);
-}}
-.tooltip.show {{ display: block; }}
-</style>
-</head>
-<body style="display:flex;flex-direction:column;">
-<div class="header">
-  <h1>{venue}{race_num}R {race_name} {surface}{distance}m</h1>
-  <div class="sub">出走馬 クッション値×含水率 解析</div>
-  <div class="target">
-    <span>CV: <b style="color:#d97706">{target_cushion}</b></span>
-    <span>含水率: <b style="color:#2563eb">{target_moisture}%</b></span>
-    <span style="color:#94a3b8">{date_label} {venue}</span>
-  </div>
-</div>
-<div class="main">
-  <div class="chart-area"><canvas id="chart"></canvas><div class="tooltip" id="tooltip"></div></div>
-  <div class="panel" id="panel"></div>
-</div>
-<div class="legend">
-  <span><span class="dot" style="background:#dc2626"></span> {color_same}</span>
-  <span><span class="dot" style="background:#2563eb"></span> {color_diff}</span>
-  <span><span class="dot" style="background:#94a3b8"></span> {color_other}</span>
-  <span>○ 3着以内 / × 4着以下</span>
-</div>
-<script>
-const HORSES = {horses_json};
-const TX = {target_cushion};
-const TY = {target_moisture};
-const TDIST = {distance};
-const COLORS = {{ same_dist:'#dc2626', diff_dist:'#2563eb', diff_surface:'#94a3b8', target:'#d97706' }};
+}
+.tooltip.show { display: block; }
+"""
+
+_SCATTER_JS = """const COLORS = { same_dist:'#dc2626', diff_dist:'#2563eb', diff_surface:'#94a3b8', target:'#d97706' };
 const X_MIN = 7.0, X_MAX = 12.0;
 const Y_MIN = 0, Y_MAX = 22;
 let selectedHorses = new Set();
@@ -427,24 +701,24 @@ let highlightedPoints = new Set();
 const canvas = document.getElementById('chart');
 const ctx = canvas.getContext('2d');
 const tooltipEl = document.getElementById('tooltip');
-const hueStep = 360 / Math.max(HORSES.length, 1);
-const horseColors = HORSES.map((_, i) => `hsl(${{i * hueStep}}, 65%, 55%)`);
+let hueStep = 0;
+let horseColors = [];
 
-function resize() {{
+function resize() {
   const rect = canvas.parentElement.getBoundingClientRect();
   const dpr = window.devicePixelRatio || 1;
   canvas.width = rect.width * dpr; canvas.height = rect.height * dpr;
   ctx.setTransform(dpr, 0, 0, dpr, 0, 0); draw();
-}}
-function toCanvasX(v) {{ const p=50; const w=canvas.width/(window.devicePixelRatio||1)-p*2; return p+(v-X_MIN)/(X_MAX-X_MIN)*w; }}
-function toCanvasY(v) {{ const pt=20,pb=40; const h=canvas.height/(window.devicePixelRatio||1)-pt-pb; return pt+(1-(v-Y_MIN)/(Y_MAX-Y_MIN))*h; }}
+}
+function toCanvasX(v) { const p=50; const w=canvas.width/(window.devicePixelRatio||1)-p*2; return p+(v-X_MIN)/(X_MAX-X_MIN)*w; }
+function toCanvasY(v) { const pt=20,pb=40; const h=canvas.height/(window.devicePixelRatio||1)-pt-pb; return pt+(1-(v-Y_MIN)/(Y_MAX-Y_MIN))*h; }
 
-function draw() {{
+function draw() {
   const W=canvas.width/(window.devicePixelRatio||1), H=canvas.height/(window.devicePixelRatio||1);
   ctx.clearRect(0,0,W,H);
   ctx.strokeStyle='#f1f5f9'; ctx.lineWidth=1;
-  for(let x=Math.ceil(X_MIN);x<=X_MAX;x+=0.5){{ const px=toCanvasX(x); ctx.beginPath();ctx.moveTo(px,20);ctx.lineTo(px,H-40);ctx.stroke(); ctx.fillStyle='#94a3b8';ctx.font='10px monospace';ctx.textAlign='center';ctx.fillText(x.toFixed(1),px,H-25); }}
-  for(let y=0;y<=Y_MAX;y+=2){{ const py=toCanvasY(y); ctx.beginPath();ctx.moveTo(50,py);ctx.lineTo(W-50,py);ctx.stroke(); ctx.fillStyle='#94a3b8';ctx.font='10px monospace';ctx.textAlign='right';ctx.fillText(y+'%',45,py+4); }}
+  for(let x=Math.ceil(X_MIN);x<=X_MAX;x+=0.5){ const px=toCanvasX(x); ctx.beginPath();ctx.moveTo(px,20);ctx.lineTo(px,H-40);ctx.stroke(); ctx.fillStyle='#94a3b8';ctx.font='10px monospace';ctx.textAlign='center';ctx.fillText(x.toFixed(1),px,H-25); }
+  for(let y=0;y<=Y_MAX;y+=2){ const py=toCanvasY(y); ctx.beginPath();ctx.moveTo(50,py);ctx.lineTo(W-50,py);ctx.stroke(); ctx.fillStyle='#94a3b8';ctx.font='10px monospace';ctx.textAlign='right';ctx.fillText(y+'%',45,py+4); }
   ctx.fillStyle='#64748b';ctx.font='bold 11px sans-serif';ctx.textAlign='center';
   ctx.fillText('クッション値',W/2,H-5);
   ctx.save();ctx.translate(12,H/2);ctx.rotate(-Math.PI/2);ctx.fillText('含水率（ゴール前）%',0,0);ctx.restore();
@@ -459,124 +733,272 @@ function draw() {{
   ctx.beginPath();ctx.moveTo(50,toCanvasY(TY));ctx.lineTo(W-50,toCanvasY(TY));ctx.stroke();
   ctx.setLineDash([]);
   const hlDeferred=[];
-  HORSES.forEach((h,hi)=>{{
+  HORSES.forEach((h,hi)=>{
     const isSel=selectedHorses.has(h.name), dimmed=selectedHorses.size>0&&!isSel;
     const alpha=dimmed?0.08:(isSel?1.0:0.7);
-    h.races.forEach((r,ri)=>{{
+    h.races.forEach((r,ri)=>{
       const isHL=highlightedPoints.has(hi+'-'+ri);
-      if(isHL){{hlDeferred.push({{h,hi,r,ri,isSel,dimmed,alpha}});return;}}
+      if(isHL){hlDeferred.push({h,hi,r,ri,isSel,dimmed,alpha});return;}
       const px=toCanvasX(r.cushion),py=toCanvasY(r.moisture),color=COLORS[r.cat];
       const sz=isSel?15:10;
       ctx.globalAlpha=alpha;
-      if(r.good){{ ctx.beginPath();ctx.arc(px,py,sz,0,Math.PI*2);ctx.fillStyle='#fff';ctx.fill();ctx.strokeStyle=color;ctx.lineWidth=isSel?3.5:2;ctx.stroke(); }}
-      else{{ ctx.strokeStyle=color;ctx.lineWidth=isSel?3.5:2;ctx.beginPath();ctx.moveTo(px-sz,py-sz);ctx.lineTo(px+sz,py+sz);ctx.stroke();ctx.beginPath();ctx.moveTo(px+sz,py-sz);ctx.lineTo(px-sz,py+sz);ctx.stroke(); }}
-      if(!dimmed){{ ctx.fillStyle=color;ctx.font=`bold ${{isSel?11:8}}px Arial`;ctx.textAlign='center';ctx.textBaseline='middle';ctx.strokeStyle='#fff';ctx.lineWidth=2.5;ctx.strokeText(r.result||'?',px,py+1);ctx.fillText(r.result||'?',px,py+1); }}
-    }});
-  }});
-  hlDeferred.forEach(({{h,hi,r,ri}})=>{{
+      if(r.good){ ctx.beginPath();ctx.arc(px,py,sz,0,Math.PI*2);ctx.fillStyle='#fff';ctx.fill();ctx.strokeStyle=color;ctx.lineWidth=isSel?3.5:2;ctx.stroke(); }
+      else{ ctx.strokeStyle=color;ctx.lineWidth=isSel?3.5:2;ctx.beginPath();ctx.moveTo(px-sz,py-sz);ctx.lineTo(px+sz,py+sz);ctx.stroke();ctx.beginPath();ctx.moveTo(px+sz,py-sz);ctx.lineTo(px-sz,py+sz);ctx.stroke(); }
+      if(!dimmed){ ctx.fillStyle=color;ctx.font=`bold ${isSel?11:8}px Arial`;ctx.textAlign='center';ctx.textBaseline='middle';ctx.strokeStyle='#fff';ctx.lineWidth=2.5;ctx.strokeText(r.result||'?',px,py+1);ctx.fillText(r.result||'?',px,py+1); }
+    });
+  });
+  hlDeferred.forEach(({h,hi,r,ri})=>{
     const px=toCanvasX(r.cushion),py=toCanvasY(r.moisture),color=COLORS[r.cat];
     const sz=18;
     ctx.globalAlpha=1.0;
     ctx.strokeStyle='#f59e0b';ctx.lineWidth=5;ctx.beginPath();ctx.arc(px,py,sz+6,0,Math.PI*2);ctx.stroke();
-    if(r.good){{ ctx.beginPath();ctx.arc(px,py,sz,0,Math.PI*2);ctx.fillStyle='#fffbeb';ctx.fill();ctx.strokeStyle='#f59e0b';ctx.lineWidth=4;ctx.stroke(); }}
-    else{{ ctx.strokeStyle='#f59e0b';ctx.lineWidth=4;ctx.beginPath();ctx.moveTo(px-sz,py-sz);ctx.lineTo(px+sz,py+sz);ctx.stroke();ctx.beginPath();ctx.moveTo(px+sz,py-sz);ctx.lineTo(px-sz,py+sz);ctx.stroke(); }}
+    if(r.good){ ctx.beginPath();ctx.arc(px,py,sz,0,Math.PI*2);ctx.fillStyle='#fffbeb';ctx.fill();ctx.strokeStyle='#f59e0b';ctx.lineWidth=4;ctx.stroke(); }
+    else{ ctx.strokeStyle='#f59e0b';ctx.lineWidth=4;ctx.beginPath();ctx.moveTo(px-sz,py-sz);ctx.lineTo(px+sz,py+sz);ctx.stroke();ctx.beginPath();ctx.moveTo(px+sz,py-sz);ctx.lineTo(px-sz,py+sz);ctx.stroke(); }
     ctx.fillStyle='#f59e0b';ctx.font='bold 13px Arial';ctx.textAlign='center';ctx.textBaseline='middle';ctx.strokeStyle='#fff';ctx.lineWidth=2.5;ctx.strokeText(r.result||'?',px,py+1);ctx.fillText(r.result||'?',px,py+1);
-  }});
+  });
   ctx.globalAlpha=1;
-  const RANK_COLORS={{S:'#dc2626',A:'#f59e0b',B:'#3b82f6',C:'#22c55e',D:'#94a3b8'}};
-  HORSES.forEach((h,hi)=>{{
-    if(ratings[h.name]){{
+  const RANK_COLORS={S:'#dc2626',A:'#f59e0b',B:'#3b82f6',C:'#22c55e',D:'#94a3b8'};
+  HORSES.forEach((h,hi)=>{
+    if(ratings[h.name]){
       const rank=ratings[h.name];const rc=RANK_COLORS[rank];
-      h.races.forEach(r=>{{
+      h.races.forEach(r=>{
         const px=toCanvasX(r.cushion),py=toCanvasY(r.moisture);
         ctx.globalAlpha=selectedHorses.size>0&&!selectedHorses.has(h.name)?0.15:1;
         ctx.fillStyle=rc;ctx.font='bold 9px Arial';ctx.textAlign='left';
         ctx.fillText(rank,px+10,py-8);
-      }});
-    }}
-  }});
+      });
+    }
+  });
   ctx.globalAlpha=1;
   const tx=toCanvasX(TX),ty=toCanvasY(TY);
   ctx.fillStyle=COLORS.target;ctx.font='bold 22px Arial';ctx.textAlign='center';ctx.textBaseline='middle';
   ctx.strokeStyle='#fff';ctx.lineWidth=3;ctx.strokeText('★',tx,ty);ctx.fillText('★',tx,ty);
   ctx.textBaseline='alphabetic';
-}}
-const ratings = {{}};
-function buildPanel(){{
+}
+const ratings = {};
+function buildPanel(){
   const panel=document.getElementById('panel');
   const RANKS=['S','A','B','C','D'];
   let html='';
-  HORSES.forEach((h,i)=>{{
+  HORSES.forEach((h,i)=>{
     const cnt=h.races.length;
-    html+=`<button class="horse-btn" id="btn-${{i}}"><span class="dot" style="background:${{horseColors[i]}}"></span>${{h.name}}<span class="count">${{cnt>0?cnt+'走':'データなし'}}</span></button>`;
-    html+=`<div class="rating-row" id="rate-${{i}}">`;
-    RANKS.forEach(r=>{{html+=`<button class="rating-btn" data-horse="${{i}}" data-rank="${{r}}">${{r}}</button>`;}});
+    html+=`<button class="horse-btn" id="btn-${i}"><span class="dot" style="background:${horseColors[i]}"></span>${h.name}<span class="count">${cnt>0?cnt+'走':'データなし'}</span></button>`;
+    html+=`<div class="rating-row" id="rate-${i}">`;
+    RANKS.forEach(r=>{html+=`<button class="rating-btn" data-horse="${i}" data-rank="${r}">${r}</button>`;});
     html+=`</div>`;
-    html+=`<div class="horse-detail" id="detail-${{i}}"><div class="race-card">${{h.races.map((r,ri)=>{{const inIdeal=Math.abs(r.cushion-TX)<=0.2&&Math.abs(r.moisture-TY)<=1.5;return`<div class="race-item ${{inIdeal?'ideal':''}}" data-horse="${{i}}" data-ri="${{ri}}"><div class="date">${{r.date}} ${{r.venue}}</div><div class="rname">${{r.race_name}}</div><div class="cond">${{r.surface}}${{r.distance}}m ${{r.distance===TDIST?'(同)':r.distance>TDIST?'(短)':'(延)'}}</div><div style="display:flex;justify-content:space-between;align-items:center;margin-top:2px"><span style="font-size:9px;color:#94a3b8">CV${{r.cushion}} / ${{r.moisture}}%</span><span class="result" style="color:${{COLORS[r.cat]}}">${{r.result!==null?r.result+'着':'取消'}}</span></div></div>`}}).join('')}}</div></div>`;
-  }});
+    html+=`<div class="horse-detail" id="detail-${i}"><div class="race-card">${h.races.map((r,ri)=>{const inIdeal=Math.abs(r.cushion-TX)<=0.2&&Math.abs(r.moisture-TY)<=1.5;return`<div class="race-item ${inIdeal?'ideal':''}" data-horse="${i}" data-ri="${ri}"><div class="date">${r.date} ${r.venue}</div><div class="rname">${r.race_name}</div><div class="cond">${r.surface}${r.distance}m ${r.distance===TDIST?'(同)':r.distance>TDIST?'(短)':'(延)'}</div><div style="display:flex;justify-content:space-between;align-items:center;margin-top:2px"><span style="font-size:9px;color:#94a3b8">CV${r.cushion} / ${r.moisture}%</span><span class="result" style="color:${COLORS[r.cat]}">${r.result!==null?r.result+'着':'取消'}</span></div></div>`}).join('')}</div></div>`;
+  });
   panel.innerHTML=html;
-  HORSES.forEach((h,i)=>{{document.getElementById('btn-'+i).addEventListener('click',()=>{{
+  HORSES.forEach((h,i)=>{document.getElementById('btn-'+i).addEventListener('click',()=>{
     const detail=document.getElementById('detail-'+i);
-    if(selectedHorses.has(h.name)){{selectedHorses.delete(h.name);detail.classList.remove('show');document.getElementById('btn-'+i).classList.remove('selected');}}
-    else{{selectedHorses.add(h.name);detail.classList.add('show');document.getElementById('btn-'+i).classList.add('selected');}}
-    requestAnimationFrame(()=>{{draw();}});
-  }});}});
-  document.querySelectorAll('.rating-btn').forEach(btn=>{{
-    btn.addEventListener('click',(e)=>{{
+    if(selectedHorses.has(h.name)){selectedHorses.delete(h.name);detail.classList.remove('show');document.getElementById('btn-'+i).classList.remove('selected');}
+    else{selectedHorses.add(h.name);detail.classList.add('show');document.getElementById('btn-'+i).classList.add('selected');}
+    requestAnimationFrame(()=>{draw();});
+  });});
+  document.querySelectorAll('.rating-btn').forEach(btn=>{
+    btn.addEventListener('click',(e)=>{
       e.stopPropagation();
       const hi=parseInt(btn.dataset.horse);
       const rank=btn.dataset.rank;
       const name=HORSES[hi].name;
-      if(ratings[name]===rank){{delete ratings[name];}}
-      else{{ratings[name]=rank;}}
+      if(ratings[name]===rank){delete ratings[name];}
+      else{ratings[name]=rank;}
       updateRatings();
-    }});
-  }});
-  document.querySelectorAll('.race-item').forEach(el=>{{
-    el.addEventListener('click',(e)=>{{
+    });
+  });
+  document.querySelectorAll('.race-item').forEach(el=>{
+    el.addEventListener('click',(e)=>{
       e.stopPropagation();
       el.classList.toggle('highlighted');
       const key=el.dataset.horse+'-'+el.dataset.ri;
       if(highlightedPoints.has(key))highlightedPoints.delete(key);else highlightedPoints.add(key);
-      requestAnimationFrame(()=>{{draw();}});
-    }});
-  }});
-}}
-function updateRatings(){{
-  document.querySelectorAll('.rating-btn').forEach(btn=>{{
+      requestAnimationFrame(()=>{draw();});
+    });
+  });
+}
+function updateRatings(){
+  document.querySelectorAll('.rating-btn').forEach(btn=>{
     const hi=parseInt(btn.dataset.horse);
     const rank=btn.dataset.rank;
     const name=HORSES[hi].name;
     btn.className='rating-btn'+(ratings[name]===rank?' rated-'+rank:'');
-  }});
+  });
   draw();
-}}
+}
 const isMobile='ontouchstart' in window;
-function getPointAt(cx,cy){{
+function getPointAt(cx,cy){
   let closest=null,minDist=isMobile?35:20;
-  HORSES.forEach(h=>{{if(selectedHorses.size>0&&!selectedHorses.has(h.name))return;h.races.forEach(r=>{{const px=toCanvasX(r.cushion),py=toCanvasY(r.moisture),d=Math.sqrt((cx-px)**2+(cy-py)**2);if(d<minDist){{minDist=d;closest={{...r,horse:h.name}};}}}});}});
+  HORSES.forEach(h=>{if(selectedHorses.size>0&&!selectedHorses.has(h.name))return;h.races.forEach(r=>{const px=toCanvasX(r.cushion),py=toCanvasY(r.moisture),d=Math.sqrt((cx-px)**2+(cy-py)**2);if(d<minDist){minDist=d;closest={...r,horse:h.name};}});});
   return closest;
-}}
-canvas.addEventListener('mousemove',(e)=>{{const rect=canvas.getBoundingClientRect();const x=e.clientX-rect.left,y=e.clientY-rect.top;const pt=getPointAt(x,y);if(pt){{tooltipEl.innerHTML=`<b>${{pt.horse}}</b><br>${{pt.date}} ${{pt.venue}} ${{pt.surface}}${{pt.distance}}m<br>${{pt.race_name}}<br><b>${{pt.result}}着</b><br>CV: ${{pt.cushion}} / 含水率: ${{pt.moisture}}%`;tooltipEl.style.left=(e.clientX+15)+'px';tooltipEl.style.top=(e.clientY-10)+'px';tooltipEl.classList.add('show');}}else{{tooltipEl.classList.remove('show');}}}});
+}
+canvas.addEventListener('mousemove',(e)=>{const rect=canvas.getBoundingClientRect();const x=e.clientX-rect.left,y=e.clientY-rect.top;const pt=getPointAt(x,y);if(pt){tooltipEl.innerHTML=`<b>${pt.horse}</b><br>${pt.date} ${pt.venue} ${pt.surface}${pt.distance}m<br>${pt.race_name}<br><b>${pt.result}着</b><br>CV: ${pt.cushion} / 含水率: ${pt.moisture}%`;tooltipEl.style.left=(e.clientX+15)+'px';tooltipEl.style.top=(e.clientY-10)+'px';tooltipEl.classList.add('show');}else{tooltipEl.classList.remove('show');}});
 canvas.addEventListener('mouseleave',()=>tooltipEl.classList.remove('show'));
 let touchTimer=null;
-function showTooltipAt(cx,cy,tx,ty){{const pt=getPointAt(cx,cy);if(pt){{tooltipEl.innerHTML=`<b>${{pt.horse}}</b><br>${{pt.date}} ${{pt.venue}} ${{pt.surface}}${{pt.distance}}m<br>${{pt.race_name}}<br><b>${{pt.result!==null?pt.result+'着':'取消'}}</b><br>CV: ${{pt.cushion}} / 含水率: ${{pt.moisture}}%`;const left=Math.min(tx+15,window.innerWidth-260);const top=Math.max(ty-40,10);tooltipEl.style.left=left+'px';tooltipEl.style.top=top+'px';tooltipEl.classList.add('show');}}else{{tooltipEl.classList.remove('show');}}}}
-canvas.addEventListener('touchstart',(e)=>{{const t=e.touches[0];const rect=canvas.getBoundingClientRect();showTooltipAt(t.clientX-rect.left,t.clientY-rect.top,t.clientX,t.clientY);}},{{passive:true}});
-canvas.addEventListener('touchmove',(e)=>{{const t=e.touches[0];const rect=canvas.getBoundingClientRect();showTooltipAt(t.clientX-rect.left,t.clientY-rect.top,t.clientX,t.clientY);}},{{passive:true}});
-canvas.addEventListener('touchend',()=>{{if(touchTimer)clearTimeout(touchTimer);touchTimer=setTimeout(()=>tooltipEl.classList.remove('show'),2000);}});
-canvas.addEventListener('click',(e)=>{{const rect=canvas.getBoundingClientRect();showTooltipAt(e.clientX-rect.left,e.clientY-rect.top,e.clientX,e.clientY);}});
-window.addEventListener('resize',resize); buildPanel(); resize();
+function showTooltipAt(cx,cy,tx,ty){const pt=getPointAt(cx,cy);if(pt){tooltipEl.innerHTML=`<b>${pt.horse}</b><br>${pt.date} ${pt.venue} ${pt.surface}${pt.distance}m<br>${pt.race_name}<br><b>${pt.result!==null?pt.result+'着':'取消'}</b><br>CV: ${pt.cushion} / 含水率: ${pt.moisture}%`;const left=Math.min(tx+15,window.innerWidth-260);const top=Math.max(ty-40,10);tooltipEl.style.left=left+'px';tooltipEl.style.top=top+'px';tooltipEl.classList.add('show');}else{tooltipEl.classList.remove('show');}}
+canvas.addEventListener('touchstart',(e)=>{const t=e.touches[0];const rect=canvas.getBoundingClientRect();showTooltipAt(t.clientX-rect.left,t.clientY-rect.top,t.clientX,t.clientY);},{passive:true});
+canvas.addEventListener('touchmove',(e)=>{const t=e.touches[0];const rect=canvas.getBoundingClientRect();showTooltipAt(t.clientX-rect.left,t.clientY-rect.top,t.clientX,t.clientY);},{passive:true});
+canvas.addEventListener('touchend',()=>{if(touchTimer)clearTimeout(touchTimer);touchTimer=setTimeout(()=>tooltipEl.classList.remove('show'),2000);});
+canvas.addEventListener('click',(e)=>{const rect=canvas.getBoundingClientRect();showTooltipAt(e.clientX-rect.left,e.clientY-rect.top,e.clientX,e.clientY);});
+window.addEventListener('resize',resize); resize();
 </script>
 </body></html>"""
 
+
+# 静的部分のgzipはモジュールロード時に一度だけ作り、全レースの .html.gz で使い回す
+# （gzipはマルチメンバー連結をデコーダが透過的に繋いで展開する）
+_SCATTER_CSS_GZ = gzip.compress(_SCATTER_CSS.encode('utf-8'))
+_SCATTER_JS_GZ = gzip.compress(_SCATTER_JS.encode('utf-8'))
+
+# タグ間の空白・改行（アップロードサイズを無駄に膨らませるだけ）を潰す。
+# CSS/JS定数には適用しない（マークアップ部分のみ）
+_INTERTAG_WS_RE = re.compile(r'>\s+<')
+
+
+# ===== Step 5: 散布図HTML生成 =====
+def generate_scatter_html(race_data, target_cushion, target_moisture, output_path, date_label='', race_num=0):
+    """散布図HTMLを生成"""
+    race_info = race_data['race_info']
+    venue = race_info['venue']
+    race_name = race_info['race_name']
+    surface = race_info['surface']
+    distance = race_info['distance']
+
+    js_horses = []
+    for horse_name, races in race_data['horses'].items():
+        js_races = []
+        append = js_races.append
+        for r in races:
+            cushion = r.get('cushion')
+            moisture = r.get('moisture')
+            if cushion is None or moisture is None:
+                continue
+            r_surface = r['surface']
+            r_distance = r['distance']
+            result = r['result']
+            cat = ('diff_surface' if r_surface != surface
+                   else 'same_dist' if r_distance == distance
+                   else 'diff_dist')
+            append({
+                'date': r['date'],
+                'venue': r['venue'],
+                'surface': r_surface,
+                'distance': r_distance,
+                'race_name': r['race_name'],
+                'result': result,
+                'cushion': cushion,
+                'moisture': moisture,
+                'cat': cat,
+                'good': result is not None and result <= 3,
+            })
+        js_horses.append({'name': horse_name, 'races': js_races})
+
+    # 出走馬データはHTMLに埋め込まず data/race_{rid}.json に切り出し、
+    # ブラウザに fetch で読ませる（HTML側のキャッシュが効き、再生成も軽くなる）
+    race_id = race_info['race_id']
+    data_dir = os.path.join(os.path.dirname(output_path), 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    data_path = os.path.join(data_dir, f'race_{race_id}.json')
+    if orjson is not None:
+        horses_bytes = orjson.dumps(js_horses)
+    else:
+        horses_bytes = json.dumps(js_horses, ensure_ascii=False).encode('utf-8')
+    with open(data_path, 'wb') as f:
+        f.write(horses_bytes)
+
+    surface_label = '芝' if surface == '芝' else 'ダート'
+    color_same = f'同距離{surface_label}'
+    color_diff = f'他距離{surface_label}'
+    color_other = 'ダート' if surface == '芝' else '芝レース'
+
+    parts = [
+        f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
+<title>クッション値×含水率 - {venue}{race_name}</title>
+<style>
+""",
+        _SCATTER_CSS,
+        f"""</style>
+</head>
+<body style="display:flex;flex-direction:column;">
+<div class="header">
+  <h1>{venue}{race_num}R {race_name} {surface}{distance}m</h1>
+  <div class="sub">出走馬 クッション値×含水率 解析</div>
+  <div class="target">
+    <span>CV: <b style="color:#d97706">{target_cushion}</b></span>
+    <span>含水率: <b style="color:#2563eb">{target_moisture}%</b></span>
+    <span style="color:#94a3b8">{date_label} {venue}</span>
+  </div>
+</div>
+<div class="main">
+  <div class="chart-area"><canvas id="chart"></canvas><div class="tooltip" id="tooltip"></div></div>
+  <div class="panel" id="panel"></div>
+</div>
+<div class="legend">
+  <span><span class="dot" style="background:#dc2626"></span> {color_same}</span>
+  <span><span class="dot" style="background:#2563eb"></span> {color_diff}</span>
+  <span><span class="dot" style="background:#94a3b8"></span> {color_other}</span>
+  <span>○ 3着以内 / × 4着以下</span>
+</div>
+<script>
+let HORSES = [];
+const TX = {target_cushion};
+const TY = {target_moisture};
+const TDIST = {distance};
+fetch('data/race_{race_id}.json').then(r=>r.json()).then(h=>{{HORSES=h;hueStep=360/Math.max(HORSES.length,1);horseColors=HORSES.map((_,i)=>`hsl(${{i*hueStep}}, 65%, 55%)`);buildPanel();resize();}});
+""",
+        _SCATTER_JS,
+    ]
+    parts[0] = _INTERTAG_WS_RE.sub('><', parts[0])
+    parts[2] = _INTERTAG_WS_RE.sub('><', parts[2])
+
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+        for part in parts:
+            f.write(part)
+
+    # デプロイ・転送用に .html.gz も併せて出力する。静的なCSS/JSは起動時に圧縮済みの
+    # メンバーをそのまま連結し、レースごとに圧縮するのは動的部分だけ
+    with open(f'{output_path}.gz', 'wb') as f:
+        f.write(gzip.compress(parts[0].encode('utf-8')))
+        f.write(_SCATTER_CSS_GZ)
+        f.write(gzip.compress(parts[2].encode('utf-8')))
+        f.write(_SCATTER_JS_GZ)
 
     total_pts = sum(len(h['races']) for h in js_horses)
     horses_with_data = sum(1 for h in js_horses if h['races'])
     return total_pts, horses_with_data, len(js_horses)
 
 
+def process_race(race, race_data, jra_live, cushion_db, out_dir, date_label):
+    """1レース分の紐付け・散布図生成を行い、サマリー行を返す"""
+    venue = race['venue']
+    race_num = race['race_num']
+
+    # クッション値紐付け
+    race_data = link_cushion_data(race_data, cushion_db)
+
+    # 当日クッション値・含水率
+    target_cushion = jra_live.get(venue, {}).get('cushion', 9.5)
+    if race['surface'] == 'ダ':
+        target_moisture = jra_live.get(venue, {}).get('dirt_moisture', 5.0)
+    else:
+        target_moisture = jra_live.get(venue, {}).get('turf_moisture', 12.0)
+
+    # 出力ファイル名
+    safe_name = race['race_name'].replace('/', '_').replace(' ', '')
+    output_file = out_dir / f'scatter_{venue}{race_num:02d}R_{safe_name}.html'
+
+    pts, with_data, total = generate_scatter_html(
+        race_data, target_cushion, target_moisture,
+        output_file, date_label=date_label, race_num=race_num,
+    )
+    print(f"  → 生成完了: {total}頭 ({with_data}頭データあり) {pts}ポイント")
+    print(f"  → {output_file}")
+    return (venue, race_num, race['race_name'], total, pts, output_file.name)
+
+
 # ===== メインパイプライン =====
 def main():
     parser = argparse.ArgumentParser(description='競馬クッション値×含水率 散布図 一括生成')
@@ -591,9 +1013,9 @@ def main():
 
     date_str = args.date
     date_label = f"{date_str[4:6]}/{date_str[6:8]}"
-    out_dir = args.output or os.path.join(OUTPUT_DIR, date_str)
-    os.makedirs(out_dir, exist_ok=True)
-    os.makedirs(CACHE_DIR, exist_ok=True)
+    out_dir = pathlib.Path(args.output) if args.output else OUTPUT_DIR / date_str
+    out_dir.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     # Step 1: レース一覧取得
     print("=" * 60)
@@ -651,8 +1073,7 @@ def main():
     print("=" * 60)
     print(f"[Step 3] クッション値DB読み込み")
     print("=" * 60)
-    with open(CUSHION_DB_PATH, encoding='utf-8') as f:
-        cushion_db = json.load(f)
+    cushion_db = load_cushion_db()
     print(f"  DB件数: {len(cushion_db)}")
 
     # 当日データをDBに自動蓄積
@@ -661,17 +1082,26 @@ def main():
     for venue, data in jra_live.items():
         key = f"{date_fmt}_{venue}"
         if key not in cushion_db:
-            cushion_db[key] = {
+            entry = {
                 'date': date_fmt,
                 'venue': venue,
                 'cushion': data.get('cushion', data.get('cushion')),
                 'turf_goal': data.get('turf_moisture'),
                 'dirt_goal': data.get('dirt_moisture'),
             }
+            if isinstance(cushion_db, SqliteCushionDB):
+                cushion_db.add(key, entry)
+            else:
+                cushion_db[key] = entry
             added += 1
     if added > 0:
-        with open(CUSHION_DB_PATH, 'w', encoding='utf-8') as f:
-            json.dump(cushion_db, f, ensure_ascii=False, indent=2)
+        if not isinstance(cushion_db, SqliteCushionDB):
+            if orjson is not None:
+                with open(CUSHION_DB_PATH, 'wb') as f:
+                    f.write(orjson.dumps(cushion_db))
+            else:
+                with open(CUSHION_DB_PATH, 'w', encoding='utf-8') as f:
+                    json.dump(cushion_db, f, ensure_ascii=False, separators=(',', ':'))
         print(f"  → {added}件追加（DB更新: {len(cushion_db)}件）")
     else:
         print(f"  → 既存データのため追加なし")
@@ -683,58 +1113,32 @@ def main():
     print("=" * 60)
     results_summary = []
 
-    for race in races:
-        rid = race['race_id']
-        venue = race['venue']
-        race_num = race['race_num']
-        surface = race['surface']
+    # レースを跨いでスクレイピングを先行並列実行（I/Oバウンド）。処理・出力は従来どおり順次
+    # キャッシュの有無は scrape_race_data 自身が見るので、キャッシュ済みレースはネットワークに触れない
+    scrape_futures = {}
+    with ThreadPoolExecutor(max_workers=RACE_WORKERS) as race_pool:
+        for race in races:
+            scrape_futures[race['race_id']] = race_pool.submit(
+                scrape_race_data, race['race_id'], args.no_scrape)
 
-        print(f"\n--- {venue} {race_num}R {race['race_name']} {surface}{race['distance']}m ---")
+        for race in races:
+            print(f"\n--- {race['venue']} {race['race_num']}R {race['race_name']} "
+                  f"{race['surface']}{race['distance']}m ---")
 
-        # キャッシュ確認（--no-scrape時のみキャッシュ使用、通常は常に最新データ取得）
-        cache_file = os.path.join(CACHE_DIR, f'race_{rid}.json')
-        if args.no_scrape and os.path.exists(cache_file):
-            print(f"  キャッシュ使用: {cache_file}")
-            with open(cache_file, encoding='utf-8') as f:
-                race_data = json.load(f)
-        else:
-            print(f"  netkeiba スクレイピング中...")
-            race_data = scrape_race_data(rid)
+            race_data = scrape_futures[race['race_id']].result()
             if race_data is None:
                 print(f"  SKIP: データ取得失敗")
                 continue
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(race_data, f, ensure_ascii=False, indent=2)
-            print(f"  キャッシュ保存: {cache_file}")
 
-        # クッション値紐付け
-        race_data = link_cushion_data(race_data, cushion_db)
-
-        # 当日クッション値・含水率
-        target_cushion = jra_live.get(venue, {}).get('cushion', 9.5)
-        if surface == 'ダ':
-            target_moisture = jra_live.get(venue, {}).get('dirt_moisture', 5.0)
-        else:
-            target_moisture = jra_live.get(venue, {}).get('turf_moisture', 12.0)
-
-        # 出力ファイル名
-        safe_name = race['race_name'].replace('/', '_').replace(' ', '')
-        output_file = os.path.join(out_dir, f'scatter_{venue}{race_num:02d}R_{safe_name}.html')
-
-        pts, with_data, total = generate_scatter_html(
-            race_data, target_cushion, target_moisture,
-            output_file, date_label=date_label, race_num=race_num,
-        )
-        print(f"  → 生成完了: {total}頭 ({with_data}頭データあり) {pts}ポイント")
-        print(f"  → {output_file}")
-        results_summary.append((venue, race_num, race['race_name'], total, pts))
+            results_summary.append(
+                process_race(race, race_data, jra_live, cushion_db, out_dir, date_label))
 
     # サマリー
     print()
     print("=" * 60)
     print("完了サマリー")
     print("=" * 60)
-    for venue, rnum, rname, total, pts in results_summary:
+    for venue, rnum, rname, total, pts, _ in results_summary:
         print(f"  {venue}{rnum:2d}R {rname:20s} {total}頭 {pts}pts")
     print(f"\n  出力先: {out_dir}")
     print(f"  合計: {len(results_summary)}レース")
@@ -742,27 +1146,38 @@ def main():
     # インデックスページ生成
     generate_index(out_dir, results_summary, jra_live, date_label)
 
-    # デプロイ
+    # デプロイ（1レースも生成できなかった日は、空のindexで上書きしない）
     if args.deploy:
-        deploy_to_github(out_dir, date_str)
+        if results_summary:
+            deploy_to_github(out_dir, date_str)
+        else:
+            print("\n  生成レースなし: デプロイをスキップ")
+
+
+# インデックスのループ内で使うテンプレート（行ごとのf-string再構築を避ける）
+_INDEX_VENUE_TMPL = '<div class="venue"><h2>{venue}　{info}</h2>\n'
+_INDEX_ROW_TMPL = (
+    '<a href="{fname}">{rnum}R {rname} <span class="meta">{total}頭 {pts}pts</span>'
+    '<span class="arrow">→</span></a>\n'
+)
 
 
 def generate_index(out_dir, results_summary, jra_live, date_label):
     """レース一覧インデックスページを生成"""
     venues = {}
-    for venue, rnum, rname, total, pts in results_summary:
+    for venue, rnum, rname, total, pts, fname in results_summary:
         if venue not in venues:
             venues[venue] = []
-        venues[venue].append((rnum, rname, total, pts))
+        venues[venue].append((rnum, rname, total, pts, fname))
 
-    venue_info = {}
-    for venue, data in jra_live.items():
-        c = data.get('cushion', '?')
-        tm = data.get('turf_moisture', '?')
-        dm = data.get('dirt_moisture', '?')
-        venue_info[venue] = f'CV={c} 芝{tm}% ダ{dm}%'
+    venue_info = {
+        venue: f"CV={data.get('cushion', '?')} 芝{data.get('turf_moisture', '?')}% "
+               f"ダ{data.get('dirt_moisture', '?')}%"
+        for venue, data in jra_live.items()
+    }
 
-    html = f'''<!DOCTYPE html>
+    # str += の再確保を避け、断片リストを最後に一度だけ join して書き出す
+    parts = [f'''<!DOCTYPE html>
 <html lang="ja">
 <head>
 <meta charset="UTF-8">
@@ -785,29 +1200,92 @@ a .arrow {{ float:right; color:#94a3b8; }}
 <body>
 <h1>{date_label} クッション値×含水率</h1>
 <div class="sub">散布図一覧 ─ タップで各レースの散布図を表示</div>
-'''
+''']
 
-    for venue in ['東京', '京都', '小倉', '中山', '阪神', '中京', '新潟', '福島', '函館', '札幌']:
+    for venue in VENUE_ORDER:
         if venue not in venues:
             continue
         info = venue_info.get(venue, '')
-        html += f'<div class="venue"><h2>{venue}　{info}</h2>\n'
-        for rnum, rname, total, pts in sorted(venues[venue]):
-            safe_name = rname.replace('/', '_').replace(' ', '')
-            fname = f'scatter_{venue}{rnum:02d}R_{safe_name}.html'
-            html += f'<a href="{fname}">{rnum}R {rname} <span class="meta">{total}頭 {pts}pts</span><span class="arrow">→</span></a>\n'
-        html += '</div>\n'
-
-    html += '</body></html>'
-
-    index_path = os.path.join(out_dir, 'index.html')
-    with open(index_path, 'w', encoding='utf-8') as f:
-        f.write(html)
+        parts.append(_INDEX_VENUE_TMPL.format_map({'venue': venue, 'info': info}))
+        for rnum, rname, total, pts, fname in sorted(venues[venue]):
+            parts.append(_INDEX_ROW_TMPL.format_map(
+                {'fname': fname, 'rnum': rnum, 'rname': rname, 'total': total, 'pts': pts}))
+        parts.append('</div>\n')
+
+    parts.append('</body></html>')
+
+    index_path = out_dir / 'index.html'
+    with open(index_path, 'wb') as f:
+        f.write(_INTERTAG_WS_RE.sub('><', ''.join(parts)).encode('utf-8'))
     print(f"\n  インデックス: {index_path}")
 
 
 # ===== GitHub Pages デプロイ =====
-DEPLOY_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'deploy_config.json')
+DEPLOY_CONFIG_PATH = _HERE / 'deploy_config.json'
+
+# 前回デプロイ時のETag・コミット・ツリー内容のキャッシュ
+DEPLOY_STATE_PATH = _HERE / '.deploy_state.json'
+
+
+def _load_deploy_state():
+    if not DEPLOY_STATE_PATH.exists():
+        return {}
+    try:
+        if orjson is not None:
+            with open(DEPLOY_STATE_PATH, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(DEPLOY_STATE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_deploy_state(state):
+    if orjson is not None:
+        with open(DEPLOY_STATE_PATH, 'wb') as f:
+            f.write(orjson.dumps(state))
+    else:
+        with open(DEPLOY_STATE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+
+# GitHub API への同時アップロード数
+DEPLOY_WORKERS = 8
+
+
+def _output_fingerprint(out_dir):
+    """出力ディレクトリのパス+内容の指紋。前回デプロイ時と同一なら何もしない判定に使う
+
+    mtimeは含めない（index.html等は再実行のたびに書き直されるので、
+    同一内容でも指紋が変わってスキップが一切効かなくなる）。
+    """
+    h = hashlib.blake2b()
+    for e in sorted(os.scandir(out_dir), key=lambda e: e.name):
+        if e.is_file():
+            h.update(e.name.encode('utf-8') + b'\x00')
+            h.update(pathlib.Path(e.path).read_bytes())
+        elif e.is_dir() and e.name == 'data':
+            for d in sorted(os.scandir(e.path), key=lambda d: d.name):
+                if d.is_file():
+                    h.update(f'data/{d.name}'.encode('utf-8') + b'\x00')
+                    h.update(pathlib.Path(d.path).read_bytes())
+    return h.hexdigest()
+
+
+def _json_body(obj):
+    """requests の json= 経由の都度シリアライズを避け、ボディを先にbytes化する"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _git_blob_sha(data):
+    """git の blob SHA1 を計算（GitHub API が返す sha と同じ形式）
+
+    data は bytes でも mmap でもよい（コピーせずそのままハッシュに流す）。
+    """
+    h = hashlib.sha1(b'blob %d\x00' % len(data))
+    h.update(data)
+    return h.hexdigest()
 
 def deploy_to_github(out_dir, date_str):
     """GitHub Pages へ自動デプロイ（GitHub API使用、git不要）"""
@@ -817,67 +1295,181 @@ def deploy_to_github(out_dir, date_str):
     print("=" * 60)
 
     # 設定読み込み
-    if not os.path.exists(DEPLOY_CONFIG_PATH):
+    if not DEPLOY_CONFIG_PATH.exists():
         print("  deploy_config.json が見つかりません。")
         print("  以下の形式で作成してください:")
         print('  {"github_token": "ghp_xxx", "repo": "user/repo-name"}')
         return
 
-    with open(DEPLOY_CONFIG_PATH, encoding='utf-8') as f:
-        config = json.load(f)
+    if orjson is not None:
+        with open(DEPLOY_CONFIG_PATH, 'rb') as f:
+            config = orjson.loads(f.read())
+    else:
+        with open(DEPLOY_CONFIG_PATH, encoding='utf-8') as f:
+            config = json.load(f)
 
     token = config['github_token']
     repo = config['repo']
-    headers = {
+    branch = config.get('branch', 'main')
+    api_base = f'https://api.github.com/repos/{repo}'
+
+    # 出力が前回デプロイ時から動いていなければAPIに触れずに抜ける
+    state = _load_deploy_state()
+    state_valid = state.get('repo') == repo and state.get('branch') == branch
+    fingerprint = _output_fingerprint(out_dir)
+    if state_valid and state.get('fingerprint') == fingerprint:
+        print("  出力に変更なし（デプロイをスキップ）")
+        return
+
+    # アップロード専用セッション（コネクションプールでTLSハンドシェイクを使い回す）
+    gh = requests.Session()
+    gh.headers.update({
         'Authorization': f'token {token}',
         'Accept': 'application/vnd.github.v3+json',
-    }
-    api_base = f'https://api.github.com/repos/{repo}/contents'
-
-    # 既存ファイルのSHA取得（更新に必要）
-    print(f"  リポジトリ: {repo}")
-    r = requests.get(api_base, headers=headers)
-    existing = {}
-    if r.status_code == 200:
-        for item in r.json():
-            existing[item['name']] = item['sha']
-
-    # HTMLファイルをアップロード
-    html_files = [f for f in os.listdir(out_dir) if f.endswith('.html')]
-    for fname in sorted(html_files):
-        fpath = os.path.join(out_dir, fname)
-        with open(fpath, 'rb') as f:
-            content = base64.b64encode(f.read()).decode()
-
-        encoded_name = quote(fname)
-        url = f'{api_base}/{encoded_name}'
-        payload = {
-            'message': f'Update {fname} ({date_str})',
+        'Content-Type': 'application/json',
+    })
+    _gh_adapter = HTTPAdapter(
+        pool_connections=16, pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                          allowed_methods=None))
+    gh.mount('https://', _gh_adapter)
+
+    def _throttle(r):
+        # 残クォータが少ないときだけ、リセットまでの残時間を残回数で按分して待つ
+        # （平常時は待たない）
+        remaining = r.headers.get('X-RateLimit-Remaining')
+        if not (remaining and remaining.isdigit()) or int(remaining) >= 100:
+            return
+        reset = r.headers.get('X-RateLimit-Reset')
+        wait = 2.0
+        if reset and reset.isdigit():
+            wait = max(0.0, int(reset) - time.time()) / max(int(remaining), 1)
+        time.sleep(min(wait, 60.0))
+
+    # ベースコミットと既存ツリーのSHA取得。refの条件付きGET（ETag）と前回の
+    # ツリー内容キャッシュで、head が動いていなければ再取得・再パースを丸ごと省く
+    print(f"  リポジトリ: {repo} ({branch})")
+    ref_headers = {}
+    if state_valid and state.get('etag'):
+        ref_headers['If-None-Match'] = state['etag']
+    r = gh.get(f'{api_base}/git/ref/heads/{branch}', headers=ref_headers)
+    if r.status_code == 304:
+        base_commit = state['head']
+    elif r.status_code == 200:
+        base_commit = r.json()['object']['sha']
+    else:
+        print(f"  ✗ ref取得失敗: {r.status_code}")
+        return
+    etag = r.headers.get('ETag', state.get('etag') if state_valid else None)
+
+    if state_valid and state.get('head') == base_commit and state.get('existing') is not None:
+        base_tree = state['base_tree']
+        existing = state['existing']
+    else:
+        r = gh.get(f'{api_base}/git/commits/{base_commit}')
+        base_tree = r.json()['tree']['sha']
+        r = gh.get(f'{api_base}/git/trees/{base_tree}', params={'recursive': '1'})
+        existing = {}
+        if r.status_code == 200:
+            for item in r.json().get('tree', []):
+                if item['type'] == 'blob':
+                    existing[item['path']] = item['sha']
+
+    # ローカルの出力一覧（HTML + 出走馬JSON）。scandir はエントリ情報を
+    # 持って返すので、ファイル判定で個別に stat し直さない
+    local_files = [e.name for e in os.scandir(out_dir)
+                   if e.is_file() and e.name.endswith('.html')]
+    data_dir = os.path.join(out_dir, 'data')
+    if os.path.isdir(data_dir):
+        local_files += [f'data/{e.name}' for e in os.scandir(data_dir)
+                        if e.is_file() and e.name.endswith('.json')]
+
+    def _make_blob(fname):
+        """変更のあるファイルだけblobをPOSTし、ツリーエントリ用のSHAを返す
+
+        ファイルは読み込まずにmmapし、ハッシュもbase64もユーザ空間への
+        コピーなしでマッピングから直接計算する。
+        """
+        with open(os.path.join(out_dir, fname), 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            sha = _git_blob_sha(mm)
+            if existing.get(fname) == sha:
+                return fname, sha, False
+            content = _b64encode(mm).decode('ascii')
+        r = gh.post(f'{api_base}/git/blobs', data=_json_body({
             'content': content,
-        }
-        if fname in existing:
-            payload['sha'] = existing[fname]
+            'encoding': 'base64',
+        }), timeout=30)
+        r.raise_for_status()
+        _throttle(r)
+        return fname, r.json()['sha'], True
+
+    tree = []
+    changed = 0
+    msgs = []
+    with ThreadPoolExecutor(max_workers=DEPLOY_WORKERS) as ex:
+        for fname, sha, uploaded in ex.map(_make_blob, sorted(local_files)):
+            tree.append({'path': fname, 'mode': '100644', 'type': 'blob', 'sha': sha})
+            if uploaded:
+                changed += 1
+                msgs.append(f"  ✓ {fname}")
+            else:
+                msgs.append(f"  = {fname} (変更なし)")
+
+    # 古いファイルは sha=None のエントリで1コミット内で削除。
+    # 対象はこのツールが書く場所だけ（ルート直下の*.htmlとdata/*.json）に限定し、
+    # リポジトリ内の無関係なファイルには触れない
+    def _prunable(fname):
+        if '/' not in fname:
+            return fname.endswith('.html')
+        head, _, tail = fname.partition('/')
+        return head == 'data' and '/' not in tail and tail.endswith('.json')
+
+    deleted = 0
+    for fname in existing:
+        if _prunable(fname) and fname not in local_files:
+            tree.append({'path': fname, 'mode': '100644', 'type': 'blob', 'sha': None})
+            deleted += 1
+            msgs.append(f"  🗑 {fname} (古いファイル削除)")
+
+    # ファイルごとにstdoutをフラッシュせず、まとめて1回で出す
+    if msgs:
+        print('\n'.join(msgs))
+
+    if changed == 0 and deleted == 0:
+        print("\n  変更なし（コミットをスキップ）")
+        _save_deploy_state({'repo': repo, 'branch': branch, 'etag': etag,
+                            'head': base_commit, 'base_tree': base_tree,
+                            'existing': existing, 'fingerprint': fingerprint})
+        return
 
-        r = requests.put(url, headers=headers, json=payload)
-        if r.status_code in (200, 201):
-            print(f"  ✓ {fname}")
+    # ツリー → コミット → ref更新（ファイル数に関わらず3リクエスト・1コミット）
+    r = gh.post(f'{api_base}/git/trees',
+                data=_json_body({'base_tree': base_tree, 'tree': tree}), timeout=30)
+    r.raise_for_status()
+    new_tree = r.json()['sha']
+    r = gh.post(f'{api_base}/git/commits', data=_json_body({
+        'message': f'Update scatter pages ({date_str})',
+        'tree': new_tree,
+        'parents': [base_commit],
+    }), timeout=30)
+    r.raise_for_status()
+    new_commit = r.json()['sha']
+    r = gh.patch(f'{api_base}/git/refs/heads/{branch}',
+                 data=_json_body({'sha': new_commit}), timeout=30)
+    r.raise_for_status()
+    print(f"\n  コミット: {new_commit[:7]} ({changed}更新 / {deleted}削除)")
+
+    # 次回デプロイはこの状態からの差分だけを見ればよい
+    new_existing = dict(existing)
+    for entry in tree:
+        if entry['sha'] is None:
+            new_existing.pop(entry['path'], None)
         else:
-            try:
-                msg = r.json().get('message', '')
-            except Exception:
-                msg = r.text[:100]
-            print(f"  ✗ {fname}: {r.status_code} {msg}")
-        time.sleep(1)  # API レートリミット対策
-
-    # 古いファイルを削除（今回の出力にないもの）
-    for fname, sha in existing.items():
-        if fname.endswith('.html') and fname not in html_files:
-            encoded_name = quote(fname)
-            url = f'{api_base}/{encoded_name}'
-            payload = {'message': f'Remove old file {fname}', 'sha': sha}
-            r = requests.delete(url, headers=headers, json=payload)
-            if r.status_code == 200:
-                print(f"  🗑 {fname} (古いファイル削除)")
+            new_existing[entry['path']] = entry['sha']
+    _save_deploy_state({'repo': repo, 'branch': branch, 'etag': etag,
+                        'head': new_commit, 'base_tree': new_tree,
+                        'existing': new_existing, 'fingerprint': fingerprint})
 
     pages_url = f'https://{repo.split("/")[0]}.github.io/{repo.split("/")[1]}/'
     print(f"\n  デプロイ完了！")